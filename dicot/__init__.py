@@ -1,2 +1,6 @@
 from .connections import open, Connection
 from .motors import MotorList
+from .telemetry import TelemetrySink, CsvWriter, ArrowWriter, ParquetWriter
+from .monitor import Monitor, Threshold, RateOfChange
+from .scheduler import Scheduler
+from .bridge import BridgeServer, RemoteConnection
@@ -0,0 +1,211 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from . import bridge as bridge_
+from . import connections
+from . import motors
+from . import packets
+from . import registers
+
+
+ROM_SETTINGS = (
+    'reversed',
+    'return_delay',
+    'cw_angle_limit',
+    'ccw_angle_limit',
+    'torque_in_silence',
+    'warmup_time',
+    'cw_compliance_margin',
+    'ccw_compliance_margin',
+    'cw_compliance_slope',
+    'ccw_compliance_slope',
+    'punch'
+)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    transport = None
+    if args.transport == 'posix':
+        from . import transports  # not available on Windows
+        transport = transports.PosixTransport
+    with connections.open(
+            args.port, args.baudrate, args.timeout, transport) as cnx:
+        return args.func(cnx, args) or 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='dicot', description='Futaba Command-Type Servo tools.')
+    parser.add_argument('-p', '--port', required=True)
+    parser.add_argument('-b', '--baudrate', type=int, default=115200)
+    parser.add_argument('-t', '--timeout', type=float, default=0.05)
+    parser.add_argument('--transport', choices=['serial', 'posix'],
+                        default='serial')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    p = subparsers.add_parser('scan', help='find the motors on the bus')
+    p.add_argument('--ids', type=parse_ids, default=list(range(1, 128)))
+    p.set_defaults(func=scan)
+
+    p = subparsers.add_parser('status', help='show a live status table')
+    p.add_argument('--ids', type=parse_ids, required=True)
+    p.add_argument('--interval', type=float, default=0.5)  # sec
+    p.add_argument('--count', type=int)
+    p.set_defaults(func=status)
+
+    p = subparsers.add_parser('bench', help='measure bus latency and rate')
+    p.add_argument('--ids', type=parse_ids, required=True)
+    p.add_argument('--count', type=int, default=100)
+    p.set_defaults(func=bench)
+
+    p = subparsers.add_parser('dump', help='dump the ROM settings as JSON')
+    p.add_argument('--ids', type=parse_ids, required=True)
+    p.add_argument('-o', '--output', type=argparse.FileType('w'),
+                   default=sys.stdout)
+    p.set_defaults(func=dump)
+
+    p = subparsers.add_parser('load', help='load the ROM settings from JSON')
+    p.add_argument('input', type=argparse.FileType('r'))
+    p.add_argument('--no-write', dest='write', action='store_false',
+                   help='do not write the settings to the ROM')
+    p.set_defaults(func=load)
+
+    p = subparsers.add_parser('set-baud', help='change the motor baudrate')
+    p.add_argument('--ids', type=parse_ids, required=True)
+    p.add_argument('new_baudrate', type=int, choices=list(registers.BAUDRATES))
+    p.set_defaults(func=set_baud)
+
+    p = subparsers.add_parser('bridge', help='serve the bus over TCP')
+    p.add_argument('--host', default=bridge_.HOST,
+                   help='address to listen on, e.g. 0.0.0.0 to expose the bus '
+                        '(no authentication)')
+    p.add_argument('--listen-port', type=int, default=bridge_.PORT)
+    p.set_defaults(func=bridge)
+
+    return parser.parse_args(argv)
+
+
+def parse_ids(value):
+    # e.g. 1,2,5-8
+    ids = []
+    for part in value.split(','):
+        lower, _, upper = part.partition('-')
+        ids.extend(range(int(lower), int(upper or lower) + 1))
+    for id_ in ids:
+        if not (1 <= id_ <= 127):
+            raise argparse.ArgumentTypeError('id must be between 1 and 127')
+    return ids
+
+
+def scan(cnx, args):
+    found = 0
+    print(f'{"id":>3} {"model":>6} {"firm":>4}')
+    for id_ in args.ids:
+        packet = packets.SingleDataQueryPacket(id_, address=0x00, length=3)
+        reply = cnx.query(packet)
+        if not reply.valid:
+            continue
+        found += 1
+        model_no = int.from_bytes(reply.data[0:2], 'little')
+        print(f'{id_:>3} {model_no:>#6x} {reply.data[2]:>4}')
+    print(f'{found} motor(s) found')
+
+
+def status(cnx, args):
+    motors_ = motors.MotorList(cnx.motor(id_) for id_ in args.ids)
+    clear = '\x1b[H\x1b[J' if sys.stdout.isatty() else ''
+    n = 0
+    while args.count is None or n < args.count:
+        samples = motors_.samples
+        lines = [
+            f'{"id":>3} {"angle":>7} {"time":>6} {"speed":>6} {"load":>6} '
+            f'{"temp":>5} {"volt":>5}'
+        ]
+        for m, sample in zip(motors_, samples):
+            s = sample.status
+            lines.append(
+                f'{m.id:>3} {s.angle:>7.1f} {s.time:>6} {s.speed:>6} '
+                f'{s.load:>6} {s.temperature:>5} {s.voltage:>5.2f}')
+        lines.append(f'skew {samples.skew * 1000:.1f} ms')
+        print(clear + '\n'.join(lines), flush=True)
+        n += 1
+        if args.count is None or n < args.count:
+            time.sleep(args.interval)
+
+
+def bench(cnx, args):
+    motors_ = motors.MotorList(cnx.motor(id_) for id_ in args.ids)
+    latencies = []
+    for _ in range(args.count):
+        reply = cnx.query(packets.MultiDataQueryPacket(args.ids[0], flag=0x09))
+        latencies.append((reply.received - reply.sent) * 1000)
+    start = time.perf_counter()
+    for _ in range(args.count):
+        _ = motors_.statuses
+    elapsed = time.perf_counter() - start
+    print(f'round trip (ms): min {min(latencies):.2f} '
+          f'mean {statistics.mean(latencies):.2f} max {max(latencies):.2f}')
+    print(f'sweep rate: {args.count / elapsed:.1f} Hz '
+          f'({len(motors_)} motor(s))')
+
+
+def dump(cnx, args):
+    reads = registers.plan_reads(
+        r for r in registers.REGISTERS.values() if r.area == 'rom')
+    settings = {}
+    for id_ in args.ids:
+        values = {}
+        for read in reads:  # all the ROM settings come in one range read
+            reply = cnx.query(packets.SingleDataQueryPacket(
+                id_, address=read.address, length=read.length))
+            if not reply.valid:
+                print(f'no reply from id {id_}', file=sys.stderr)
+                return 1
+            values.update(registers.unpack(read, reply.data))
+        values['firm_version'] = values['firm_version'][0]  # a number
+        settings[str(id_)] = {
+            name: list(v) if isinstance(v, bytes) else v
+            for name, v in values.items()
+        }
+    json.dump(settings, args.output, indent=2)
+    args.output.write('\n')
+
+
+def load(cnx, args):
+    settings = json.load(args.input)
+    for id_, values in settings.items():
+        rom = cnx.motor(int(id_)).rom
+        with rom.transaction(write=args.write):
+            for name in ROM_SETTINGS:
+                if name in values:
+                    setattr(rom, name, values[name])
+
+
+def set_baud(cnx, args):
+    motors_ = [cnx.motor(id_) for id_ in args.ids]
+    for m in motors_:
+        m.rom.baudrate = args.new_baudrate
+        m.rom.write()
+    time.sleep(1.0)  # wait for the ROM to be written
+    for m in motors_:
+        m.restart()
+    print(f'baudrate of {len(motors_)} motor(s) set to {args.new_baudrate}')
+
+
+def bridge(cnx, args):
+    with bridge_.BridgeServer(cnx, (args.host, args.listen_port)) as server:
+        print(f'serving on {server.server_address[0]}:'
+              f'{server.server_address[1]}', flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
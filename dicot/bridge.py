@@ -0,0 +1,357 @@
+import concurrent.futures
+import itertools
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from . import motors
+from . import packets
+
+
+logger = logging.getLogger(__name__)
+
+PORT = 7474
+HOST = '127.0.0.1'  # the protocol has no authentication
+
+# Frame: type, request id and payload length, followed by the payload.
+HEADER = struct.Struct('>BHH')
+QUERY_HEADER = struct.Struct('>HB')  # query length, packet length
+REPLY_HEADER = struct.Struct('>ddH')  # sent, received, reply length
+
+COMMAND = 0x01
+QUERY = 0x02  # one or more queries, answered in one reply
+SUBSCRIBE = 0x03
+UNSUBSCRIBE = 0x04
+INFO = 0x05
+REPLY = 0x80
+PUSH = 0x81
+ERROR = 0xff
+
+
+def connect(host, port=PORT, timeout=1):
+    cnx = RemoteConnection(host, port, timeout)
+    cnx.open()
+    return cnx
+
+
+class RemoteConnection:
+
+    def __init__(self, host, port=PORT, timeout=1):
+        self.host = host
+        self.port = port
+        self.timeout = timeout  # sec, per query
+        self.sock = None
+        self._baudrate = None
+        self._pending = {}  # request id: future
+        self._subscriptions = {}  # request id: callback
+        self._ids = itertools.cycle(range(1, 0x10000))
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._reader = None
+
+    def open(self):
+        self.sock = socket.create_connection(
+            (self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(None)
+        self._rfile = self.sock.makefile('rb')
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        info = self._wait(*self._request(INFO))
+        self._baudrate, = struct.unpack('>I', info)
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join()
+        self._rfile.close()
+        self.sock.close()
+        self.sock = None
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    def motor(self, id_):
+        return motors.Motor(self, id_)
+
+    def command(self, packet):
+        with self._send_lock:
+            send_frame(self.sock, COMMAND, 0, bytes(packet.bytes))
+
+    def query(self, packet):
+        return self.query_many([packet])[0]
+
+    def query_many(self, packets_):
+        # The bridge may spend a serial timeout on every absent motor.
+        payload = self._wait(
+            *self._request(QUERY, encode_queries(packets_)),
+            timeout=self.timeout * max(1, len(packets_)))
+        return decode_replies(payload)
+
+    def query_async(self, packets_):
+        # Requests are pipelined: any number of them may be in flight.
+        future = concurrent.futures.Future()
+        _, request = self._request(QUERY, encode_queries(packets_))
+        request.add_done_callback(
+            lambda f: chain_future(f, future, decode_replies))
+        return future
+
+    def subscribe(self, ids, period, callback):
+        # The bridge pushes the 0x09 block of the motors every period (sec);
+        # the callback receives the replies of one sweep.
+        payload = struct.pack('>d', period) + bytes(ids)
+        subscription, future = self._request(SUBSCRIBE, payload, callback)
+        self._wait(subscription, future)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._wait(*self._request(
+            UNSUBSCRIBE, struct.pack('>H', subscription)))
+        with self._lock:
+            self._subscriptions.pop(subscription, None)
+
+    def _request(self, type_, payload=b'', callback=None):
+        future = concurrent.futures.Future()
+        with self._lock:
+            # Ids wrap around, so skip the ones still in use.
+            request_id = next(self._ids)
+            while (request_id in self._pending or
+                   request_id in self._subscriptions):
+                request_id = next(self._ids)
+            self._pending[request_id] = future
+            if callback is not None:
+                self._subscriptions[request_id] = callback
+        with self._send_lock:
+            send_frame(self.sock, type_, request_id, payload)
+        return request_id, future
+
+    def _wait(self, request_id, future, timeout=None):
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+
+    def _read(self):
+        try:
+            while True:
+                try:
+                    frame = recv_frame(self._rfile)
+                except OSError:
+                    frame = None
+                if frame is None:
+                    break
+                self._handle(*frame)
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(
+                    ConnectionError('bridge connection closed'))
+
+    def _handle(self, type_, request_id, payload):
+        if type_ == PUSH:
+            callback = self._subscriptions.get(request_id)
+            if callback is not None:
+                # A failing callback must not stop the replies.
+                try:
+                    callback(decode_replies(payload))
+                except Exception:
+                    logger.exception('subscription callback failed')
+            return
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+        if future is None:
+            return
+        if type_ == ERROR:
+            future.set_exception(IOError(payload.decode()))
+        else:
+            future.set_result(payload)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BridgeServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, cnx, address=(HOST, PORT)):
+        # The local connection is shared by all the clients. Anyone who can
+        # reach the address can drive the motors, so it is local by default.
+        self.cnx = cnx
+        self.lock = threading.Lock()
+        super().__init__(address, BridgeHandler)
+
+    def query_many(self, packets_):
+        with self.lock:
+            return self.cnx.query_many(packets_)
+
+    def command(self, packet):
+        with self.lock:
+            self.cnx.command(packet)
+
+
+class BridgeHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.subscriptions = {}
+
+    def handle(self):
+        while True:
+            try:
+                frame = recv_frame(self.rfile)
+            except OSError:
+                frame = None
+            if frame is None:
+                break
+            type_, request_id, payload = frame
+            try:
+                self.dispatch(type_, request_id, payload)
+            except Exception as e:
+                self.send(ERROR, request_id, str(e).encode())
+
+    def finish(self):
+        for subscription in self.subscriptions.values():
+            subscription.stop()
+        super().finish()
+
+    def dispatch(self, type_, request_id, payload):
+        server = self.server
+        if type_ == COMMAND:
+            server.command(RawPacket(payload))
+        elif type_ == QUERY:
+            replies = server.query_many(decode_queries(payload))
+            self.send(REPLY, request_id, encode_replies(replies))
+        elif type_ == SUBSCRIBE:
+            period, = struct.unpack('>d', payload[:8])
+            subscription = Subscription(self, request_id, payload[8:], period)
+            old = self.subscriptions.pop(request_id, None)
+            if old is not None:
+                old.stop()
+            self.subscriptions[request_id] = subscription
+            self.send(REPLY, request_id)
+            subscription.start()
+        elif type_ == UNSUBSCRIBE:
+            subscription_id, = struct.unpack('>H', payload)
+            subscription = self.subscriptions.pop(subscription_id, None)
+            if subscription is not None:
+                subscription.stop()
+            self.send(REPLY, request_id)
+        elif type_ == INFO:
+            self.send(REPLY, request_id, struct.pack(
+                '>I', int(server.cnx.baudrate)))
+        else:
+            raise ValueError(f'unknown frame type {type_:#x}')
+
+    def send(self, type_, request_id, payload=b''):
+        with self.send_lock:
+            send_frame(self.request, type_, request_id, payload)
+
+
+class Subscription(threading.Thread):
+
+    def __init__(self, handler, id_, ids, period):
+        super().__init__(daemon=True)
+        self.handler = handler
+        self.id = id_
+        self.packets = [
+            packets.MultiDataQueryPacket(i, flag=0x09) for i in ids]
+        self.period = period
+        self.stopped = threading.Event()
+
+    def run(self):
+        next_time = time.perf_counter()
+        while not self.stopped.is_set():
+            replies = self.handler.server.query_many(self.packets)
+            try:
+                self.handler.send(PUSH, self.id, encode_replies(replies))
+            except OSError:
+                break
+            next_time += self.period
+            self.stopped.wait(max(0, next_time - time.perf_counter()))
+
+    def stop(self):
+        self.stopped.set()
+
+
+class RawPacket:
+
+    def __init__(self, bytes_, query_length=None):
+        self.bytes = bytes_
+        self.query_length = query_length
+
+
+def send_frame(sock, type_, request_id, payload=b''):
+    sock.sendall(HEADER.pack(type_, request_id, len(payload)) + payload)
+
+
+def recv_frame(rfile):
+    header = rfile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    type_, request_id, length = HEADER.unpack(header)
+    payload = rfile.read(length)
+    if len(payload) < length:
+        return None
+    return type_, request_id, payload
+
+
+def encode_queries(packets_):
+    return b''.join(
+        QUERY_HEADER.pack(p.query_length, len(p.bytes)) + bytes(p.bytes)
+        for p in packets_)
+
+
+def decode_queries(payload):
+    packets_ = []
+    offset = 0
+    while offset < len(payload):
+        query_length, length = QUERY_HEADER.unpack_from(payload, offset)
+        offset += QUERY_HEADER.size
+        packets_.append(
+            RawPacket(payload[offset:offset + length], query_length))
+        offset += length
+    return packets_
+
+
+def encode_replies(replies):
+    return b''.join(
+        REPLY_HEADER.pack(r.sent, r.received, len(r.bytes)) + bytes(r.bytes)
+        for r in replies)
+
+
+def decode_replies(payload):
+    # The timestamps are taken on the bridge host.
+    replies = []
+    offset = 0
+    while offset < len(payload):
+        sent, received, length = REPLY_HEADER.unpack_from(payload, offset)
+        offset += REPLY_HEADER.size
+        replies.append(packets.ReturnPacket(
+            payload[offset:offset + length], sent, received))
+        offset += length
+    return replies
+
+
+def chain_future(source, target, convert):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(convert(source.result()))
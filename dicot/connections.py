@@ -1,25 +1,25 @@
+import time
+
 import serial
 
 from . import motors
 from . import packets
 
 
-def open(port, baudrate=115200, timeout=1):
-    cnx = Connection(port, baudrate, timeout)
+def open(port, baudrate=115200, timeout=1, transport=None):
+    cnx = Connection(port, baudrate, timeout, transport)
     cnx.open()
     return cnx
 
 
 class Connection:
 
-    def __init__(self, port, baudrate=115200, timeout=1):
-        self.ser = serial.Serial()
-        self.ser.port = port
-        self.ser.baudrate = baudrate
-        self.ser.bytesize = serial.EIGHTBITS
-        self.ser.parity = serial.PARITY_NONE
-        self.ser.stopbits = serial.STOPBITS_ONE
-        self.ser.timeout = timeout
+    def __init__(self, port, baudrate=115200, timeout=1, transport=None):
+        # A transport takes (port, baudrate, timeout) and returns an object
+        # behaving like serial.Serial, see dicot.transports for the others.
+        if transport is None:
+            transport = serial_transport
+        self.ser = transport(port, baudrate, timeout)
 
     def open(self):
         self.ser.open()
@@ -27,18 +27,45 @@ class Connection:
     def close(self):
         self.ser.close()
 
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
     def motor(self, id_):
         return motors.Motor(self, id_)
 
     def command(self, packet):
         self.ser.write(packet.bytes)
 
+    def command_many(self, packets_):
+        buffers = [p.bytes for p in packets_]
+        if hasattr(self.ser, 'writev'):
+            self.ser.writev(buffers)
+        else:
+            self.ser.write(b''.join(buffers))
+
     def query(self, packet):
+        sent = time.time()
         self.ser.write(packet.bytes)
-        return packets.ReturnPacket(self.ser.read(packet.query_length))
+        bytes_ = self.ser.read(packet.query_length)
+        return packets.ReturnPacket(bytes_, sent, time.time())
+
+    def query_many(self, packets_):
+        return [self.query(p) for p in packets_]
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
+
+
+def serial_transport(port, baudrate, timeout):
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = baudrate
+    ser.bytesize = serial.EIGHTBITS
+    ser.parity = serial.PARITY_NONE
+    ser.stopbits = serial.STOPBITS_ONE
+    ser.timeout = timeout
+    return ser
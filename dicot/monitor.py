@@ -0,0 +1,114 @@
+import collections
+import time
+
+from . import motors
+from . import scheduler
+
+
+Trip = collections.namedtuple(
+    'Trip', ['id', 'rule', 'action', 'timestamp', 'latency'])
+
+
+class Threshold:
+
+    def __init__(self, field, upper=None, lower=None, action='off'):
+        motors.check_key(field, motors.Status._fields)
+        motors.check_key(action, ['off', 'brake'])
+        self.field = field
+        self.upper = upper
+        self.lower = lower
+        self.action = action
+
+    def check(self, previous, status, elapsed):
+        value = getattr(status, self.field)
+        if self.upper is not None and value > self.upper:
+            return True
+        if self.lower is not None and value < self.lower:
+            return True
+        return False
+
+    def __repr__(self):
+        return (f'Threshold({self.field!r}, upper={self.upper}, '
+                f'lower={self.lower}, action={self.action!r})')
+
+
+class RateOfChange:
+
+    def __init__(self, field, limit, action='off'):
+        motors.check_key(field, motors.Status._fields)
+        motors.check_key(action, ['off', 'brake'])
+        self.field = field
+        self.limit = limit  # per second
+        self.action = action
+
+    def check(self, previous, status, elapsed):
+        if previous is None or elapsed <= 0:
+            return False
+        change = getattr(status, self.field) - getattr(previous, self.field)
+        return abs(change) / elapsed > self.limit
+
+    def __repr__(self):
+        return (f'RateOfChange({self.field!r}, {self.limit}, '
+                f'action={self.action!r})')
+
+
+class Monitor:
+
+    def __init__(self, rules, cxn=None, on_trip=None):
+        # Rules are evaluated in order and the first one tripped decides
+        # the action of the motor.
+        self.rules = rules
+        self.cxn = cxn
+        self.on_trip = on_trip
+        self.trips = []
+        self.tripped = set()
+        self._previous = {}  # id: (timestamp, status)
+
+    def poll(self, motors_):
+        statuses = motors_.statuses
+        self.feed(motors_, statuses)
+        return statuses
+
+    def feed(self, motors_, statuses, timestamp=None):
+        detected = time.perf_counter()
+        if timestamp is None:
+            timestamp = time.time()
+        actions = collections.OrderedDict()  # id: (rule, action)
+        for m, status in zip(motors_, statuses):
+            previous, elapsed = None, 0
+            if m.id in self._previous:
+                previous_timestamp, previous = self._previous[m.id]
+                elapsed = timestamp - previous_timestamp
+            self._previous[m.id] = (timestamp, status)
+            if m.id in self.tripped:
+                continue
+            for rule in self.rules:
+                if rule.check(previous, status, elapsed):
+                    actions[m.id] = (rule, rule.action)
+                    break
+        if not actions:
+            return []
+        cxn = self.cxn if self.cxn is not None else motors_[0].cxn
+        if isinstance(cxn, scheduler.Channel):
+            # Protective packets go ahead of any queued traffic.
+            cxn = cxn.scheduler.connection('emergency')
+        ids = list(actions.keys())
+        cxn.command(motors.torque_modes_packet(
+            ids, [action for _, action in actions.values()]))
+        latency = time.perf_counter() - detected
+        trips = [
+            Trip(id_, rule, action, timestamp, latency)
+            for id_, (rule, action) in actions.items()
+        ]
+        self.tripped.update(ids)
+        self.trips.extend(trips)
+        if self.on_trip is not None:
+            for trip in trips:
+                self.on_trip(trip)
+        return trips
+
+    def reset(self, id_=None):
+        if id_ is None:
+            self.tripped.clear()
+        else:
+            self.tripped.discard(id_)
@@ -1,16 +1,134 @@
+import collections
+import contextlib
 import functools
 import itertools
 import operator
 
 from . import packets
+from . import registers
 
 
-class Motor:
+class RegisterAccess:
+
+    _pending = None  # buffered writes of the open transaction
+
+    def read_register(self, name):
+        register = self.registers[name]
+        if register.block is not None:
+            packet = packets.MultiDataQueryPacket(self.id, flag=register.block)
+            offset = register.address - registers.BLOCKS[register.block][0]
+            data = self.cxn.query(packet).data[offset:offset + register.size]
+        else:
+            packet = packets.SingleDataQueryPacket(
+                self.id, address=register.address, length=register.size)
+            data = self.cxn.query(packet).data
+        value = register.decode(data)
+        self._read({name: value})
+        return value
+
+    def write_register(self, name, value):
+        self.write_registers(**{name: value})
+
+    def read_registers(self, *names):
+        # The registers are read in as few range reads as possible.
+        values = {}
+        for read in registers.plan_reads(self.registers[n] for n in names):
+            packet = packets.SingleDataQueryPacket(
+                self.id, address=read.address, length=read.length)
+            values.update(registers.unpack(read, self.cxn.query(packet).data))
+        self._read(values)
+        return collections.OrderedDict((n, values[n]) for n in names)
+
+    def write_registers(self, **values):
+        # All the values are checked before anything is sent, and adjacent
+        # registers are written in one packet.
+        items = [self._encode(n, v) for n, v in values.items()]
+        if self._pending is not None:
+            self._pending.append((items, values))
+            return
+        self._command_writes(items, values)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Setters inside the block are checked immediately but only sent,
+        # coalesced, when the block exits without an exception.
+        if self._pending is not None:
+            # Joins the outer transaction; an exception drops what this
+            # block added, even when the outer block goes on.
+            mark = len(self._pending)
+            try:
+                yield self
+            except BaseException:
+                del self._pending[mark:]
+                raise
+            return
+        self._pending = []
+        try:
+            yield self
+            pending = self._pending
+        finally:
+            self._pending = None
+        items = []
+        values = collections.OrderedDict()
+        for items_, values_ in pending:
+            items.extend(items_)
+            values.update(values_)
+        self._command_writes(items, values)
+
+    def _command_writes(self, items, values):
+        # A new id takes effect at once, so it is written after the others.
+        writes = registers.plan_writes(
+            i for i in items if i[0].name != 'id')
+        writes.extend(registers.plan_writes(
+            i for i in items if i[0].name == 'id'))
+        for write in writes:
+            packet = packets.SingleDataCommandPacket(
+                self.id, address=write.address, data=write.data)
+            self.cxn.command(packet)
+        self._written(values)
+
+    def _encode(self, name, value):
+        check_key(name, self.registers.keys())
+        register = self.registers[name]
+        if register.readonly:
+            raise ValueError(f'{name} is read-only')
+        if register.limits is not None:
+            check_limit(value, *register.limits)
+        if isinstance(register.codec, registers.Enum):
+            check_key(value, register.codec.keys)
+        return register, register.encode(value)
+
+    def _read(self, values):
+        pass
+
+    def _written(self, values):
+        pass
+
+
+class Motor(RegisterAccess):
 
     def __init__(self, cxn, id_):
         self.cxn = cxn
+        self.registers = registers.REGISTERS
         self.rom = Rom(cxn, id_)
 
+    @property
+    def _pending(self):
+        return self.rom._pending
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # The motor shares the buffer of its ROM, so ROM setters and the id
+        # inside either block are part of the same transaction.
+        with self.rom.transaction():
+            yield self
+
+    def _read(self, values):
+        self.rom._read(values)
+
+    def _written(self, values):
+        self.rom._written(values)
+
     def restart(self):
         packet = packets.SpecialCommandPacket(
             self.id, flag=0x20, address=0xff, length=0x00)
@@ -23,13 +141,11 @@ class Motor:
 
     @property
     def model_no(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x00, length=2)
-        return self.cxn.query(packet).data[::-1]  # h, l
+        return self.read_register('model_no')  # h, l
 
     @property
     def firm_version(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x02)
-        return self.cxn.query(packet).data
+        return self.read_register('firm_version')
 
     @property
     def id(self):
@@ -40,48 +156,13 @@ class Motor:
         self.rom.id = new_id
 
     def rotate(self, degree, msec=None):
-        check_limit(degree, -150.0, 150.0)
         if msec is None:
             msec = 0
-        check_limit(msec, 0, 163830)
-        data = degree_to_data(degree) + msec_to_data(msec)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x1e, data=data)
-        self.cxn.command(packet)
-
-    @property
-    def max_torque(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x23)
-        return ord(self.cxn.query(packet).data)  # percent
-
-    @max_torque.setter
-    def max_torque(self, percent):
-        check_limit(percent, 0, 100)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x23, data=[percent])
-        self.cxn.command(packet)
-
-    @property
-    def torque_mode(self):
-        map_ = {0x00: 'off', 0x01: 'on', 0x02: 'brake'}
-        packet = packets.SingleDataQueryPacket(self.id, address=0x24)
-        return map_[ord(self.cxn.query(packet).data)]
-
-    @torque_mode.setter
-    def torque_mode(self, mode):
-        map_ = {'off': 0x00, 'on': 0x01, 'brake': 0x02}
-        check_key(mode, map_.keys())
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x24, data=[map_[mode]])
-        self.cxn.command(packet)
+        self.write_registers(goal_position=degree, goal_time=msec)
 
     @property
     def torque_enabled(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x24)
-        if ord(self.cxn.query(packet).data) == 0:
-            return False
-        else:
-            return True  # 1 or 2
+        return self.torque_mode != 'off'  # on or brake
 
     @torque_enabled.setter
     def torque_enabled(self, enabled):
@@ -90,277 +171,106 @@ class Motor:
         else:
             self.torque_mode = 'off'
 
-    @property
-    def pid_coeff(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x26)
-        return ord(self.cxn.query(packet).data)  # percent
-
-    @pid_coeff.setter
-    def pid_coeff(self, percent):
-        check_limit(percent, 1, 255)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x26, data=[percent])
-        self.cxn.command(packet)
-
     @property
     def angle(self):
-        packet = packets.MultiDataQueryPacket(self.id, flag=0x09)
-        return data_to_degree(self.cxn.query(packet).data[0:2])  # degree
+        return self.read_register('angle')  # degree
 
     @angle.setter
     def angle(self, degree):
         self.rotate(degree)
 
     @property
-    def time(self):
-        packet = packets.MultiDataQueryPacket(self.id, flag=0x09)
-        return data_to_value(self.cxn.query(packet).data[2:4]) * 10  # ms
-
-    @property
-    def speed(self):
-        packet = packets.MultiDataQueryPacket(self.id, flag=0x09)
-        return data_to_value(self.cxn.query(packet).data[4:6])  # deg/sec
-
-    @property
-    def load(self):
+    def status(self):
         packet = packets.MultiDataQueryPacket(self.id, flag=0x09)
-        return data_to_value(self.cxn.query(packet).data[6:8])  # mA
+        return data_to_status(self.cxn.query(packet).data)
 
     @property
-    def temperature(self):
+    def sample(self):
+        if self.rom.cached_return_delay is None:
+            _ = self.rom.return_delay
         packet = packets.MultiDataQueryPacket(self.id, flag=0x09)
-        return data_to_value(self.cxn.query(packet).data[8:10])  # Celsius
+        return self.to_sample(packet, self.cxn.query(packet))
+
+    def to_sample(self, packet, reply):
+        # The motor latches the values after receiving the query, then
+        # waits the return delay and transmits the reply (10 bits/byte).
+        wire_time = packet.query_length * 10 / self.cxn.baudrate
+        sampled = max(
+            reply.sent,
+            reply.received - wire_time - self.rom.cached_return_delay / 1e6)
+        return Sample(
+            status=data_to_status(reply.data),
+            sent=reply.sent,
+            received=reply.received,
+            sampled=sampled
+        )
 
-    @property
-    def voltage(self):
-        packet = packets.MultiDataQueryPacket(self.id, flag=0x09)
-        return data_to_volt(self.cxn.query(packet).data[10:12])  # V
 
+class Rom(RegisterAccess):
 
-class Rom:
+    _write_requested = False
 
     def __init__(self, cxn, id_):
         self.cxn = cxn
+        self.registers = registers.REGISTERS
         self._id = id_
+        self.cached_return_delay = None
 
     def write(self):
         packet = packets.SpecialCommandPacket(
             self.id, flag=0x40, address=0xff, length=0x00)
         self.cxn.command(packet)
 
+    @contextlib.contextmanager
+    def transaction(self, write=False):
+        # The ROM is written once, after the outermost block has sent the
+        # values; a nested block asking for it passes that on to the outer.
+        outermost = self._pending is None
+        if outermost:
+            self._write_requested = False
+        with super().transaction():
+            yield self
+            self._write_requested = self._write_requested or write
+        if outermost and self._write_requested:
+            self.write()
+
     @property
     def id(self):
         return self._id
 
     @id.setter
     def id(self, new_id):
-        check_limit(new_id, 1, 127)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x04, data=[new_id])
-        self.cxn.command(packet)
-        self._id = new_id
-
-    @property
-    def reversed(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x05)
-        if ord(self.cxn.query(packet).data) == 0:
-            return False
-        else:
-            return True  # 1
-
-    @reversed.setter
-    def reversed(self, reversed):
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x05, data=[0x01 if reversed else 0x00])
-        self.cxn.command(packet)
-
-    @property
-    def baudrate(self):
-        map_ = {
-            0x00: 9600,
-            0x01: 14400,
-            0x02: 19200,
-            0x03: 28800,
-            0x04: 38400,
-            0x05: 57600,
-            0x06: 76800,
-            0x07: 115200,
-            0x08: 153600,
-            0x09: 230400
-        }
-        packet = packets.SingleDataQueryPacket(self.id, address=0x06)
-        return map_[ord(self.cxn.query(packet).data)]
-
-    @baudrate.setter
-    def baudrate(self, bps):
-        map_ = {
-            9600: 0x00,
-            14400: 0x01,
-            19200: 0x02,
-            28800: 0x03,
-            38400: 0x04,
-            57600: 0x05,
-            76800: 0x06,
-            115200: 0x07,
-            153600: 0x08,
-            230400: 0x09
-        }
-        check_key(bps, map_.keys())
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x06, data=[map_[bps]])
-        self.cxn.command(packet)
+        self.write_register('id', new_id)
 
-    @property
-    def return_delay(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x07)
-        return (ord(self.cxn.query(packet).data) * 50) + 100  # us
-
-    @return_delay.setter
-    def return_delay(self, us):
-        check_limit(us, 100, 12850)  # limit is undocumented
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x07, data=[(us - 100) // 50])
-        self.cxn.command(packet)
+    def _read(self, values):
+        if 'return_delay' in values:
+            self.cached_return_delay = values['return_delay']
 
-    @property
-    def cw_angle_limit(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x08, length=2)
-        return data_to_degree(self.cxn.query(packet).data)  # degree
-
-    @cw_angle_limit.setter
-    def cw_angle_limit(self, degree):
-        check_limit(degree, 0, 150.0)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x08, data=degree_to_data(degree))
-        self.cxn.command(packet)
-
-    @property
-    def ccw_angle_limit(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x0a, length=2)
-        return data_to_degree(self.cxn.query(packet).data)  # degree
-
-    @ccw_angle_limit.setter
-    def ccw_angle_limit(self, degree):
-        check_limit(degree, -150.0, 0)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x0a, data=degree_to_data(degree))
-        self.cxn.command(packet)
-
-    @property
-    def temperature_limit(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x0e, length=2)
-        return data_to_value(self.cxn.query(packet).data)  # Celsius
-
-    @property
-    def torque_in_silence(self):
-        map_ = {0x00: 'off', 0x01: 'on', 0x02: 'brake'}
-        packet = packets.SingleDataQueryPacket(self.id, address=0x16)
-        return map_[ord(self.cxn.query(packet).data)]
-
-    @torque_in_silence.setter
-    def torque_in_silence(self, mode):
-        map_ = {'off': 0x00, 'on': 0x01, 'brake': 0x02}
-        check_key(mode, map_.keys())
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x16, data=[map_[mode]])
-        self.cxn.command(packet)
-
-    @property
-    def warmup_time(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x17)
-        return ord(self.cxn.query(packet).data) * 10  # ms
-
-    @warmup_time.setter
-    def warmup_time(self, ms):
-        check_limit(ms, 0, 2550)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x17, data=[(ms // 10)])
-        self.cxn.command(packet)
-
-    @property
-    def cw_compliance_margin(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x18)
-        return ord(self.cxn.query(packet).data) / 10  # degree
-
-    @cw_compliance_margin.setter
-    def cw_compliance_margin(self, degree):
-        check_limit(degree, 0, 25.5)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x18, data=[int(degree * 10)])
-        self.cxn.command(packet)
-
-    @property
-    def ccw_compliance_margin(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x19)
-        return ord(self.cxn.query(packet).data) / 10  # degree
-
-    @ccw_compliance_margin.setter
-    def ccw_compliance_margin(self, degree):
-        check_limit(degree, 0, 25.5)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x19, data=[int(degree * 10)])
-        self.cxn.command(packet)
-
-    @property
-    def cw_compliance_slope(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x1a)
-        return ord(self.cxn.query(packet).data)  # degree
-
-    @cw_compliance_slope.setter
-    def cw_compliance_slope(self, degree):
-        check_limit(degree, 0, 255)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x1a, data=[degree])
-        self.cxn.command(packet)
-
-    @property
-    def ccw_compliance_slope(self):
-        packet = packets.SingleDataQueryPacket(self.id, address=0x1b)
-        return ord(self.cxn.query(packet).data)  # degree
-
-    @ccw_compliance_slope.setter
-    def ccw_compliance_slope(self, degree):
-        check_limit(degree, 0, 255)
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x1b, data=[degree])
-        self.cxn.command(packet)
-
-    @property
-    def punch(self):
-        # It uses raw bytes
-        # because the punch value is different depending on the motor model.
-        packet = packets.SingleDataQueryPacket(self.id, address=0x1c, length=2)
-        return self.cxn.query(packet).data[::-1]  # h, l
-
-    @punch.setter
-    def punch(self, data):  # data = [h, l]
-        # It uses raw bytes
-        # because the punch value is different depending on the motor model.
-        packet = packets.SingleDataCommandPacket(
-            self.id, address=0x1c, data=data[::-1])
-        self.cxn.command(packet)
+    def _written(self, values):
+        if 'id' in values:
+            self._id = values['id']
+        if 'return_delay' in values:
+            self.cached_return_delay = values['return_delay']
 
 
 class MotorList(list):
 
+    def __init__(self, motors=(), deadband=None, refresh_every=None):
+        super().__init__(motors)
+        self.deadband = deadband  # degree, None sends every motor
+        self.refresh_every = refresh_every  # rotations between full sends
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        self._last = {}  # id: last goal position sent (0.1 degree)
+        self._ticks = 0
+
     @property
     def torque_modes(self):
         return [m.torque_mode for m in self]
 
     @torque_modes.setter
     def torque_modes(self, modes):
-        map_ = {'off': 0x00, 'on': 0x01, 'brake': 0x02}
-        for m in modes:
-            check_key(m, map_.keys())
-        data = itertools.chain.from_iterable(
-            zip([m.id for m in self], [map_[m] for m in modes]))
-        packet = packets.MultiDataCommandPacket(
-            address=0x24,
-            length=0x02,
-            count=len(self),
-            data=data
-        )
-        self[0].cxn.command(packet)
+        self[0].cxn.command(torque_modes_packet([m.id for m in self], modes))
 
     @property
     def torque_enabled(self):
@@ -373,23 +283,44 @@ class MotorList(list):
     def rotate(self, degrees, msecs=None):
         for d in degrees:
             check_limit(d, -150.0, 150.0)
-        zippee = [
-            [bytes([m.id]) for m in self],
-            [degree_to_data(d) for d in degrees]
-        ]
         if msecs is not None:
             for s in msecs:
                 check_limit(s, 0, 163830)
-            zippee.append([msec_to_data(s) for s in msecs])
-        data = itertools.chain.from_iterable(
-            [functools.reduce(operator.add, e) for e in zip(*zippee)])
-        packet = packets.MultiDataCommandPacket(
-            address=0x1e,
-            length=0x03 if msecs is None else 0x05,
-            count=len(self),
-            data=data
-        )
-        self[0].cxn.command(packet)
+        ids = [m.id for m in self]
+        if self.deadband is None:
+            packet = rotate_packet(ids, degrees, msecs)
+            self[0].cxn.command(packet)
+            self.bytes_sent += len(packet.bytes)
+            return
+        # Change-only mode: motors whose target moved no more than the
+        # deadband from the last one sent are left out of the packet.
+        refresh = (self.refresh_every is not None and
+                   self._ticks % self.refresh_every == 0)
+        self._ticks += 1
+        entries = zip(ids, degrees, [None] * len(ids) if msecs is None
+                      else msecs)
+        changed = [e for e in entries if refresh or self._moved(e[0], e[1])]
+        sent = 0
+        if changed:
+            ids_, degrees_, msecs_ = zip(*changed)
+            packet = rotate_packet(
+                ids_, degrees_, None if msecs is None else msecs_)
+            self[0].cxn.command(packet)
+            sent = len(packet.bytes)
+        for id_, degree, _ in changed:
+            self._last[id_] = int(degree * 10)
+        full = 8 + len(ids) * (0x03 if msecs is None else 0x05)
+        self.bytes_sent += sent
+        self.bytes_saved += full - sent
+
+    def refresh(self):
+        # The next rotate sends every motor.
+        self._last.clear()
+
+    def _moved(self, id_, degree):
+        last = self._last.get(id_)
+        return last is None or abs(int(degree * 10) - last) > \
+            self.deadband * 10
 
     @property
     def angles(self):
@@ -399,6 +330,103 @@ class MotorList(list):
     def angles(self, degrees):
         self.rotate(degrees)
 
+    @property
+    def statuses(self):
+        packets_ = self._status_packets()
+        replies = self[0].cxn.query_many(packets_)
+        return [data_to_status(r.data) for r in replies]
+
+    @property
+    def samples(self):
+        for m in self:
+            if m.rom.cached_return_delay is None:
+                _ = m.rom.return_delay
+        packets_ = self._status_packets()
+        replies = self[0].cxn.query_many(packets_)
+        return SampleList(
+            m.to_sample(p, r) for m, p, r in zip(self, packets_, replies))
+
+    def read_registers(self, *names):
+        # The same range reads for every motor, sent in one batch.
+        reads = registers.plan_reads(self[0].registers[n] for n in names)
+        packets_ = [
+            packets.SingleDataQueryPacket(
+                m.id, address=r.address, length=r.length)
+            for m in self for r in reads
+        ]
+        replies = iter(self[0].cxn.query_many(packets_))
+        result = []
+        for m in self:
+            values = {}
+            for read in reads:
+                values.update(registers.unpack(read, next(replies).data))
+            m._read(values)
+            result.append(
+                collections.OrderedDict((n, values[n]) for n in names))
+        return result
+
+    def _status_packets(self):
+        return [packets.MultiDataQueryPacket(m.id, flag=0x09) for m in self]
+
+
+class SampleList(list):
+
+    @property
+    def skew(self):
+        # Spread of the estimated sample times across the motors.
+        if not self:
+            return 0.0
+        sampled = [s.sampled for s in self]
+        return max(sampled) - min(sampled)
+
+
+Status = collections.namedtuple(
+    'Status', ['angle', 'time', 'speed', 'load', 'temperature', 'voltage'])
+
+
+Sample = collections.namedtuple(
+    'Sample', ['status', 'sent', 'received', 'sampled'])
+
+
+STATUS_READ = registers.Read(
+    *registers.BLOCKS[0x09],
+    tuple(registers.REGISTERS[name] for name in Status._fields))
+
+
+def data_to_status(data):
+    return Status(**registers.unpack(STATUS_READ, data))
+
+
+def rotate_packet(ids, degrees, msecs=None):
+    zippee = [
+        [bytes([i]) for i in ids],
+        [degree_to_data(d) for d in degrees]
+    ]
+    if msecs is not None:
+        zippee.append([msec_to_data(s) for s in msecs])
+    data = itertools.chain.from_iterable(
+        [functools.reduce(operator.add, e) for e in zip(*zippee)])
+    return packets.MultiDataCommandPacket(
+        address=0x1e,
+        length=0x03 if msecs is None else 0x05,
+        count=len(ids),
+        data=data
+    )
+
+
+def torque_modes_packet(ids, modes):
+    map_ = registers.TORQUE_MODES
+    for m in modes:
+        check_key(m, map_.keys())
+    data = itertools.chain.from_iterable(
+        zip(ids, [map_[m] for m in modes]))
+    return packets.MultiDataCommandPacket(
+        address=0x24,
+        length=0x02,
+        count=len(ids),
+        data=data
+    )
+
 
 def degree_to_data(degree):
     return value_to_data(int(degree * 10))
@@ -432,3 +460,25 @@ def check_limit(value, lower, upper):
 def check_key(value, keys):
     if value not in keys:
         raise ValueError(f'value must be one of {keys}')
+
+
+def register_property(name):
+    def getter(self):
+        return self.read_register(name)
+
+    def setter(self, value):
+        self.write_register(name, value)
+
+    return property(
+        getter, None if registers.REGISTERS[name].readonly else setter)
+
+
+def define_register_properties(cls, area):
+    # Hand-written accessors take precedence over the generated ones.
+    for name, register in registers.REGISTERS.items():
+        if register.area == area and name not in vars(cls):
+            setattr(cls, name, register_property(name))
+
+
+define_register_properties(Motor, 'ram')
+define_register_properties(Rom, 'rom')
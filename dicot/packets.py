@@ -114,13 +114,25 @@ class LongPacket:
 
 class ReturnPacket:
 
-    def __init__(self, bytes):
+    def __init__(self, bytes, sent=None, received=None):
         self.bytes = bytes
+        self.sent = sent  # host time when the query was sent
+        self.received = received  # host time when the reply was read
 
     @property
     def data(self):
         return self.bytes[7:-1]
 
+    @property
+    def valid(self):
+        b = self.bytes
+        return (
+            len(b) >= 8 and
+            b[0:2] == b'\xfd\xdf' and
+            len(b) == b[5] * b[6] + 8 and
+            checksum(b[:-1]) == b[-1]
+        )
+
 
 def checksum(bytes_):
     cs = bytes_[2]
@@ -0,0 +1,215 @@
+import collections
+
+
+AREAS = {
+    'rom': (0x00, 0x1e),  # no. 00-29
+    'ram': (0x1e, 0x3c)  # no. 30-59
+}
+
+TORQUE_MODES = {'off': 0x00, 'on': 0x01, 'brake': 0x02}
+
+BAUDRATES = {
+    9600: 0x00,
+    14400: 0x01,
+    19200: 0x02,
+    28800: 0x03,
+    38400: 0x04,
+    57600: 0x05,
+    76800: 0x06,
+    115200: 0x07,
+    153600: 0x08,
+    230400: 0x09
+}
+
+Read = collections.namedtuple('Read', ['address', 'length', 'registers'])
+
+Write = collections.namedtuple('Write', ['address', 'data'])
+
+
+class Register:
+
+    def __init__(self, name, address, size=1, codec=None, limits=None,
+                 readonly=False, signed=None, block=None):
+        self.name = name
+        self.address = address
+        self.size = size
+        self.codec = Scale() if codec is None else codec
+        self.limits = limits  # (lower, upper) of the value
+        self.readonly = readonly
+        self.signed = size > 1 if signed is None else signed
+        self.block = block  # flag of the block read serving it alone
+
+    @property
+    def area(self):
+        for name, (lower, upper) in AREAS.items():
+            if lower <= self.address < upper:
+                return name
+        return None
+
+    @property
+    def end(self):
+        return self.address + self.size
+
+    def decode(self, data):
+        return self.codec.decode(data, self)
+
+    def encode(self, value):
+        return bytes(self.codec.encode(value, self))
+
+    def __repr__(self):
+        return f'Register({self.name!r}, {self.address:#04x}, {self.size})'
+
+
+class Scale:
+    # value = raw * multiplier / divisor + offset
+
+    def __init__(self, multiplier=1, divisor=1, offset=0):
+        self.multiplier = multiplier
+        self.divisor = divisor
+        self.offset = offset
+
+    def decode(self, data, register):
+        raw = int.from_bytes(data, 'little', signed=register.signed)
+        if self.divisor == 1:
+            return raw * self.multiplier + self.offset
+        return raw * self.multiplier / self.divisor + self.offset
+
+    def encode(self, value, register):
+        if self.divisor == 1:
+            raw = (value - self.offset) // self.multiplier
+        else:
+            raw = int((value - self.offset) * self.divisor / self.multiplier)
+        return int(raw).to_bytes(
+            register.size, 'little', signed=register.signed)
+
+
+class Enum:
+
+    def __init__(self, map_):
+        self.map = map_  # value: raw
+
+    @property
+    def keys(self):
+        return self.map.keys()
+
+    def decode(self, data, register):
+        return {v: k for k, v in self.map.items()}[data[0]]
+
+    def encode(self, value, register):
+        return [self.map[value]]
+
+
+class Bool:
+
+    def decode(self, data, register):
+        return data[0] != 0
+
+    def encode(self, value, register):
+        return [0x01 if value else 0x00]
+
+
+class Raw:
+    # Bytes high first, as the motor manual shows them.
+
+    def decode(self, data, register):
+        return data[::-1]  # h, l
+
+    def encode(self, value, register):
+        return bytes(value)[::-1]
+
+
+DEGREE = Scale(divisor=10)
+
+REGISTERS = collections.OrderedDict((r.name, r) for r in [
+    # ROM
+    Register('model_no', 0x00, 2, Raw(), readonly=True),
+    Register('firm_version', 0x02, codec=Raw(), readonly=True),
+    Register('id', 0x04, limits=(1, 127)),
+    Register('reversed', 0x05, codec=Bool()),
+    Register('baudrate', 0x06, codec=Enum(BAUDRATES)),
+    Register('return_delay', 0x07, codec=Scale(multiplier=50, offset=100),
+             limits=(100, 12850)),  # us, limit is undocumented
+    Register('cw_angle_limit', 0x08, 2, DEGREE, limits=(0, 150.0)),
+    Register('ccw_angle_limit', 0x0a, 2, DEGREE, limits=(-150.0, 0)),
+    Register('temperature_limit', 0x0e, 2, readonly=True),  # Celsius
+    Register('torque_in_silence', 0x16, codec=Enum(TORQUE_MODES)),
+    Register('warmup_time', 0x17, codec=Scale(multiplier=10),
+             limits=(0, 2550)),  # ms
+    Register('cw_compliance_margin', 0x18, codec=DEGREE, limits=(0, 25.5)),
+    Register('ccw_compliance_margin', 0x19, codec=DEGREE, limits=(0, 25.5)),
+    Register('cw_compliance_slope', 0x1a, limits=(0, 255)),  # degree
+    Register('ccw_compliance_slope', 0x1b, limits=(0, 255)),  # degree
+    # The punch value is different depending on the motor model,
+    # so it uses raw bytes.
+    Register('punch', 0x1c, 2, Raw()),
+    # RAM
+    Register('goal_position', 0x1e, 2, DEGREE, limits=(-150.0, 150.0)),
+    Register('goal_time', 0x20, 2, Scale(multiplier=10),
+             limits=(0, 163830)),  # ms
+    Register('max_torque', 0x23, limits=(0, 100)),  # percent
+    Register('torque_mode', 0x24, codec=Enum(TORQUE_MODES)),
+    Register('pid_coeff', 0x26, limits=(1, 255)),  # percent
+    Register('angle', 0x2a, 2, DEGREE, readonly=True, block=0x09),
+    Register('time', 0x2c, 2, Scale(multiplier=10), readonly=True,
+             block=0x09),  # ms
+    Register('speed', 0x2e, 2, readonly=True, block=0x09),  # deg/sec
+    Register('load', 0x30, 2, readonly=True, block=0x09),  # mA
+    Register('temperature', 0x32, 2, readonly=True, block=0x09),  # Celsius
+    Register('voltage', 0x34, 2, Scale(divisor=100), readonly=True,
+             block=0x09),  # V
+])
+
+BLOCKS = {
+    # flag: (address, length)
+    0x03: (0x00, 30),  # no. 00-29
+    0x05: (0x1e, 30),  # no. 30-59
+    0x07: (0x14, 10),  # no. 20-29
+    0x09: (0x2a, 18),  # no. 42-59
+    0x0b: (0x1e, 12),  # no. 30-41
+    0x0d: (0x3c, 67)  # no. 60-127
+}
+
+
+def plan_reads(registers, max_gap=None):
+    # Every read costs a round trip, so registers of one area are served by
+    # a single range read unless they are more than max_gap bytes apart.
+    reads = []
+    for r in sorted(set(registers), key=lambda r: r.address):
+        last = reads[-1] if reads else None
+        if (last is not None and
+                last.registers[0].area == r.area and
+                (max_gap is None or
+                 r.address - (last.address + last.length) <= max_gap)):
+            reads[-1] = Read(
+                last.address,
+                max(last.address + last.length, r.end) - last.address,
+                last.registers + (r,))
+        else:
+            reads.append(Read(r.address, r.size, (r,)))
+    return reads
+
+
+def plan_writes(items):
+    # items: (register, data); later items win, adjacent addresses of one
+    # area are merged into a single contiguous write.
+    by_address = collections.OrderedDict()
+    for register, data in items:
+        by_address[register.address] = (register, bytes(data))
+    writes = []
+    last_register = None
+    for address in sorted(by_address):
+        register, data = by_address[address]
+        if (writes and
+                last_register.area == register.area and
+                writes[-1].address + len(writes[-1].data) == address):
+            writes[-1] = Write(writes[-1].address, writes[-1].data + data)
+        else:
+            writes.append(Write(address, data))
+        last_register = register
+    return writes
+
+
+def unpack(read, data):
+    return collections.OrderedDict(
+        (r.name, r.decode(data[r.address - read.address:r.end - read.address]))
+        for r in read.registers)
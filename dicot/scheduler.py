@@ -0,0 +1,289 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+from . import motors
+
+
+PRIORITIES = ('emergency', 'motion', 'telemetry', 'config')
+
+SHARES = {
+    'emergency': None,  # unlimited
+    'motion': 0.5,
+    'telemetry': 0.3,
+    'config': 0.2
+}
+
+MAX_BATCH = 16  # commands per vectored write
+
+EPSILON = 1e-9  # bytes, absorbs the rounding of the refill
+
+Stats = collections.namedtuple(
+    'Stats', [
+        'submitted', 'dispatched', 'queue_depth', 'max_queue_depth',
+        'mean_latency', 'max_latency', 'missed_deadlines'
+    ])
+
+
+class Scheduler:
+
+    def __init__(self, cnx, shares=None, burst=0.02, start=True):
+        # Each class gets a token bucket of its share of the bus bandwidth;
+        # a 8N1 frame takes 10 bits on the wire per byte.
+        if shares is None:
+            shares = SHARES
+        bytes_per_sec = cnx.baudrate / 10
+        self.cnx = cnx
+        self.budgets = {
+            name: None if shares[name] is None
+            else Budget(bytes_per_sec * shares[name], burst)
+            for name in PRIORITIES
+        }
+        self._queues = {name: [] for name in PRIORITIES}
+        self._stats = {name: ClassStats() for name in PRIORITIES}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        if start:
+            self.start()
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def submit(self, packet, priority='config', deadline=None, query=False):
+        motors.check_key(priority, PRIORITIES)
+        now = time.perf_counter()
+        future = concurrent.futures.Future()
+        item = Item(
+            key=(float('inf') if deadline is None else now + deadline,
+                 next(self._seq)),
+            packet=packet,
+            query=query,
+            submitted=now,
+            future=future
+        )
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('scheduler is closed')
+            heapq.heappush(self._queues[priority], item)
+            self._stats[priority].submit(len(self._queues[priority]))
+            self._cond.notify()
+        return future
+
+    def command(self, packet, priority='config', deadline=None):
+        self.submit(packet, priority, deadline).result()
+
+    def query(self, packet, priority='config', deadline=None):
+        return self.submit(packet, priority, deadline, query=True).result()
+
+    def query_many(self, packets, priority='config', deadline=None):
+        futures = [
+            self.submit(p, priority, deadline, query=True) for p in packets]
+        return [f.result() for f in futures]
+
+    def connection(self, priority):
+        motors.check_key(priority, PRIORITIES)
+        return Channel(self, priority)
+
+    def stats(self):
+        with self._cond:
+            return {
+                name: self._stats[name].snapshot(len(self._queues[name]))
+                for name in PRIORITIES
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    priority, wait = self._select()
+                    if priority is not None:
+                        break
+                    if self._closed and wait is None:
+                        return
+                    self._cond.wait(wait)
+                items = [heapq.heappop(self._queues[priority])]
+                if not items[0].query:
+                    items.extend(self._take_commands(priority))
+            if len(items) == 1:
+                self._dispatch(priority, items[0])
+            else:
+                self._dispatch_commands(priority, items)
+
+    def _select(self):
+        # Strict priority among classes with budget left, deadline order
+        # within a class. Returns the time to wait when nothing is eligible.
+        now = time.perf_counter()
+        wait = None
+        for name in PRIORITIES:
+            queue = self._queues[name]
+            if not queue:
+                continue
+            budget = self.budgets[name]
+            if budget is None:
+                return name, None
+            delay = budget.consume(queue[0].cost, now)
+            if delay <= 0:
+                return name, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _take_commands(self, priority):
+        # Commands queued back to back are written together.
+        queue = self._queues[priority]
+        budget = self.budgets[priority]
+        now = time.perf_counter()
+        items = []
+        while (queue and not queue[0].query and
+               len(items) < MAX_BATCH - 1 and
+               (budget is None or budget.consume(queue[0].cost, now) <= 0)):
+            items.append(heapq.heappop(queue))
+        return items
+
+    def _dispatch_commands(self, priority, items):
+        items = [i for i in items if i.future.set_running_or_notify_cancel()]
+        try:
+            if hasattr(self.cnx, 'command_many'):
+                self.cnx.command_many([i.packet for i in items])
+            else:
+                for i in items:
+                    self.cnx.command(i.packet)
+        except Exception as e:
+            for i in items:
+                i.future.set_exception(e)
+        else:
+            for i in items:
+                i.future.set_result(None)
+        finished = time.perf_counter()
+        with self._cond:
+            for i in items:
+                self._stats[priority].dispatch(
+                    finished - i.submitted, finished > i.key[0])
+
+    def _dispatch(self, priority, item):
+        if not item.future.set_running_or_notify_cancel():
+            return
+        try:
+            if item.query:
+                result = self.cnx.query(item.packet)
+            else:
+                result = self.cnx.command(item.packet)
+        except Exception as e:
+            item.future.set_exception(e)
+        else:
+            item.future.set_result(result)
+        finished = time.perf_counter()
+        with self._cond:
+            self._stats[priority].dispatch(
+                finished - item.submitted, finished > item.key[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Channel:
+
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    @property
+    def baudrate(self):
+        return self.scheduler.cnx.baudrate
+
+    def motor(self, id_):
+        return motors.Motor(self, id_)
+
+    def command(self, packet, deadline=None):
+        self.scheduler.command(packet, self.priority, deadline)
+
+    def query(self, packet, deadline=None):
+        return self.scheduler.query(packet, self.priority, deadline)
+
+    def query_many(self, packets, deadline=None):
+        return self.scheduler.query_many(packets, self.priority, deadline)
+
+
+class Item:
+
+    def __init__(self, key, packet, query, submitted, future):
+        self.key = key  # (deadline, seq)
+        self.packet = packet
+        self.query = query
+        self.submitted = submitted
+        self.future = future
+        self.cost = len(packet.bytes)
+        if query:
+            self.cost += packet.query_length
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class Budget:
+
+    def __init__(self, rate, burst):
+        self.rate = rate  # bytes/sec
+        self.capacity = max(rate * burst, 128)
+        self.tokens = self.capacity
+        self.updated = time.perf_counter()
+
+    def consume(self, cost, now):
+        # A packet larger than the bucket goes out once the bucket is full
+        # and leaves it in debt, so it delays the class instead of blocking.
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed - EPSILON:
+            self.tokens -= cost
+            return 0
+        return (needed - self.tokens) / self.rate
+
+
+class ClassStats:
+
+    def __init__(self):
+        self.submitted = 0
+        self.dispatched = 0
+        self.max_queue_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.missed_deadlines = 0
+
+    def submit(self, depth):
+        self.submitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def dispatch(self, latency, missed):
+        self.dispatched += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if missed:
+            self.missed_deadlines += 1
+
+    def snapshot(self, depth):
+        return Stats(
+            submitted=self.submitted,
+            dispatched=self.dispatched,
+            queue_depth=depth,
+            max_queue_depth=self.max_queue_depth,
+            mean_latency=(self.total_latency / self.dispatched
+                          if self.dispatched else 0.0),
+            max_latency=self.max_latency,
+            missed_deadlines=self.missed_deadlines
+        )
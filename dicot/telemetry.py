@@ -0,0 +1,175 @@
+import array
+import csv
+import queue
+import threading
+import time
+
+from . import motors
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+COLUMNS = (
+    ('timestamp', 'd'),  # sec
+    ('id', 'B'),
+    ('angle', 'd'),  # degree
+    ('time', 'i'),  # ms
+    ('speed', 'i'),  # deg/sec
+    ('load', 'i'),  # mA
+    ('temperature', 'i'),  # Celsius
+    ('voltage', 'd')  # V
+)
+
+
+class TelemetrySink:
+
+    def __init__(self, writer, chunk_size=10000, max_pending=4):
+        # Memory is bounded by chunk_size * (max_pending + 2) rows:
+        # the buffer being filled, the queued chunks and the one in writing.
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self._columns = new_columns()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def append(self, motors_, statuses=None, timestamp=None):
+        if statuses is None and timestamp is None:
+            # Each row is stamped with its estimated sample time.
+            samples = motors_.samples
+            statuses = [s.status for s in samples]
+            timestamps = [s.sampled for s in samples]
+        else:
+            if statuses is None:
+                statuses = motors_.statuses
+            if timestamp is None:
+                timestamp = time.time()
+            timestamps = [timestamp] * len(statuses)
+        columns = self._columns
+        for m, status, timestamp in zip(motors_, statuses, timestamps):
+            columns['timestamp'].append(timestamp)
+            columns['id'].append(m.id)
+            for name in motors.Status._fields:
+                columns[name].append(getattr(status, name))
+        if len(columns['id']) >= self.chunk_size:
+            self.flush()
+        return statuses
+
+    def __len__(self):
+        return len(self._columns['id'])
+
+    def flush(self):
+        self._raise_error()
+        if not len(self):
+            return
+        columns, self._columns = self._columns, new_columns()
+        self._queue.put(columns)  # blocks while the writer is behind
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self.writer.close()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            columns = self._queue.get()
+            if columns is None:
+                break
+            if self._error is not None:
+                continue  # drain so that the producer never blocks
+            try:
+                self.writer.write(columns)
+            except Exception as e:
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvWriter:
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.csv = csv.writer(self.file)
+        self.csv.writerow([name for name, _ in COLUMNS])
+
+    def write(self, columns):
+        self.csv.writerows(zip(*columns.values()))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter:
+
+    def __init__(self, path):
+        check_pyarrow()
+        self.schema = arrow_schema()
+        self.stream = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, columns):
+        self.stream.write_batch(to_record_batch(columns, self.schema))
+
+    def close(self):
+        self.stream.close()
+
+
+class ParquetWriter:
+
+    def __init__(self, path, compression='snappy'):
+        check_pyarrow()
+        self.schema = arrow_schema()
+        self.parquet = pyarrow.parquet.ParquetWriter(
+            path, self.schema, compression=compression)
+
+    def write(self, columns):
+        batch = to_record_batch(columns, self.schema)
+        self.parquet.write_table(pyarrow.Table.from_batches([batch]))
+
+    def close(self):
+        self.parquet.close()
+
+
+def new_columns():
+    return {name: array.array(typecode) for name, typecode in COLUMNS}
+
+
+def check_pyarrow():
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Arrow and Parquet output')
+
+
+def arrow_schema():
+    map_ = {'d': pyarrow.float64(), 'B': pyarrow.uint8(), 'i': pyarrow.int32()}
+    return pyarrow.schema(
+        [(name, map_[typecode]) for name, typecode in COLUMNS])
+
+
+def to_record_batch(columns, schema):
+    # The column buffers are handed to Arrow without copying.
+    arrays = [
+        pyarrow.Array.from_buffers(
+            field.type, len(columns[field.name]),
+            [None, pyarrow.py_buffer(columns[field.name])])
+        for field in schema
+    ]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
@@ -0,0 +1,184 @@
+import array
+import fcntl
+import os
+import select
+import struct
+import termios
+import time
+import tty
+
+
+# Linux ioctls, as in linux/serial.h and asm-generic/ioctls.h.
+TIOCGSERIAL = 0x541e
+TIOCSSERIAL = 0x541f
+ASYNC_LOW_LATENCY = 0x2000
+TCGETS2 = 0x802c542a
+TCSETS2 = 0x402c542b
+BOTHER = 0o010000
+CBAUD = 0o010017
+TERMIOS2 = struct.Struct('4I B 19s 2I')
+
+
+class PosixTransport:
+    # A raw non-blocking tty fd waited on by epoll (select where epoll is not
+    # available), without pyserial's read buffering in between.
+
+    def __init__(self, port, baudrate=115200, timeout=1, low_latency=True):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.low_latency = low_latency
+        self.low_latency_enabled = False
+        self.fd = None
+        self._poll = None
+
+    def open(self):
+        self.fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            self._configure()
+            if self.low_latency:
+                self.low_latency_enabled = set_low_latency(self.fd)
+                set_latency_timer(self.port, 1)  # ms
+        except BaseException:
+            self.close()
+            raise
+        self._open_poll()
+
+    def close(self):
+        if self._poll is not None:
+            self._poll.close()
+            self._poll = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, size=1):
+        # Returns early with the bytes read so far on timeout, like pyserial.
+        buf = bytearray()
+        deadline = time.monotonic() + self.timeout
+        while len(buf) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._wait(remaining):
+                break
+            try:
+                buf.extend(os.read(self.fd, size - len(buf)))
+            except BlockingIOError:
+                pass
+        return bytes(buf)
+
+    def write(self, data):
+        self.writev([data])
+
+    def writev(self, buffers):
+        # Queued packets go out in one system call unless the driver takes
+        # only part of them; the rest follows from where it stopped.
+        buffers = [memoryview(b) for b in buffers if len(b)]
+        deadline = time.monotonic() + self.timeout
+        while buffers:
+            try:
+                n = os.writev(self.fd, buffers)
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0 or
+                        not select.select([], [self.fd], [], remaining)[1]):
+                    raise TimeoutError('write timeout')
+                continue
+            while n:
+                if n < len(buffers[0]):
+                    buffers[0] = buffers[0][n:]
+                    break
+                n -= len(buffers.pop(0))
+
+    def _configure(self):
+        attrs = termios.tcgetattr(self.fd)
+        attrs[0] = 0  # iflag
+        attrs[1] = 0  # oflag
+        attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+        attrs[3] = 0  # lflag
+        attrs[6][termios.VMIN] = 0
+        attrs[6][termios.VTIME] = 0
+        speed = getattr(termios, f'B{self.baudrate}', None)
+        if speed is not None:
+            attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        if speed is None:
+            set_custom_baudrate(self.fd, self.baudrate)
+        termios.tcflush(self.fd, termios.TCIOFLUSH)
+
+    def _open_poll(self):
+        if hasattr(select, 'epoll'):
+            self._poll = select.epoll()
+            self._poll.register(self.fd, select.EPOLLIN)
+
+    def _wait(self, timeout):
+        if self._poll is not None:
+            return bool(self._poll.poll(timeout))
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PtyTransport(PosixTransport):
+    # A pseudo terminal for testing: the transport owns the master side and
+    # a fake bus can be attached to peer_fd or the peer device path.
+
+    def __init__(self, port=None, baudrate=115200, timeout=1):
+        super().__init__(port, baudrate, timeout, low_latency=False)
+        self.peer_fd = None
+
+    @property
+    def peer(self):
+        return os.ttyname(self.peer_fd)
+
+    def open(self):
+        self.fd, self.peer_fd = os.openpty()
+        tty.setraw(self.peer_fd)
+        os.set_blocking(self.fd, False)
+        self._open_poll()
+
+    def close(self):
+        super().close()
+        if self.peer_fd is not None:
+            os.close(self.peer_fd)
+            self.peer_fd = None
+
+
+def set_low_latency(fd):
+    # Not every driver supports it (e.g. pseudo terminals).
+    buf = array.array('i', [0] * 32)
+    try:
+        fcntl.ioctl(fd, TIOCGSERIAL, buf)
+        buf[4] |= ASYNC_LOW_LATENCY  # flags
+        fcntl.ioctl(fd, TIOCSSERIAL, buf)
+    except OSError:
+        return False
+    return True
+
+
+def set_latency_timer(port, ms):
+    # FTDI adapters hold received bytes up to 16 ms by default.
+    name = os.path.basename(os.path.realpath(port))
+    path = f'/sys/bus/usb-serial/devices/{name}/latency_timer'
+    try:
+        with open(path, 'w') as f:
+            f.write(str(ms))
+    except OSError:
+        return False
+    return True
+
+
+def set_custom_baudrate(fd, baudrate):
+    buf = bytearray(TERMIOS2.size)
+    fcntl.ioctl(fd, TCGETS2, buf)
+    fields = list(TERMIOS2.unpack(buf))
+    fields[2] = (fields[2] & ~CBAUD) | BOTHER  # cflag
+    fields[6] = fields[7] = baudrate  # ispeed, ospeed
+    fcntl.ioctl(fd, TCSETS2, TERMIOS2.pack(*fields))
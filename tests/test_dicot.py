@@ -1,6 +1,19 @@
+import concurrent.futures
+import itertools
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
 import pytest
 
 import dicot
+import dicot.__main__
+from dicot import packets as packets_
 
 
 port = 'COM1'
@@ -278,3 +291,634 @@ def test_multiple_rotate(cnx):
     motors.angles = [10, 10, 50]
     b = b'\xfa\xaf\x00\x00\x1e\x03\x03\x01\x64\x00\x02\x64\x00\x05\xf4\x01\xed'
     cnx.ser.write.assert_called_once_with(b)
+
+
+def test_status(cnx):
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x2a\x12\x01\x4e\xfb\x37' \
+        b'\x02\x2c\x01\x06\x00\x2d\x00\xf4\x01\x00\x00\x00\x00\x00\x00\x10'
+    motor = cnx.motor(1)
+    status = motor.status
+    cnx.ser.write.assert_called_once_with(b'\xfa\xaf\x01\x09\x00\x00\x01\x09')
+    assert status == (-120.2, 5670, 300, 6, 45, 5.0)
+
+
+def test_telemetry_csv(cnx, tmp_path):
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00' \
+        b'\x00\x00\x00\x06\x00\x2d\x00\xf4\x01\x00\x00\x00\x00\x00\x00\x00'
+    motors = dicot.MotorList([cnx.motor(1), cnx.motor(2)])
+    path = tmp_path / 'telemetry.csv'
+    with dicot.TelemetrySink(dicot.CsvWriter(path), chunk_size=3) as sink:
+        sink.append(motors, timestamp=1.0)
+        assert len(sink) == 2
+        sink.append(motors, timestamp=2.0)
+        assert len(sink) == 0  # flushed
+        sink.append(motors, timestamp=3.0)
+    lines = path.read_text().splitlines()
+    assert lines[0] == 'timestamp,id,angle,time,speed,load,temperature,voltage'
+    assert lines[1] == '1.0,1,90.0,0,0,6,45,5.0'
+    assert len(lines) == 7
+
+
+def test_telemetry_parquet(cnx, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00' \
+        b'\x00\x00\x00\x06\x00\x2d\x00\xf4\x01\x00\x00\x00\x00\x00\x00\x00'
+    motors = dicot.MotorList([cnx.motor(1), cnx.motor(2)])
+    path = str(tmp_path / 'telemetry.parquet')
+    with dicot.TelemetrySink(dicot.ParquetWriter(path)) as sink:
+        sink.append(motors, timestamp=1.0)
+    table = parquet.read_table(path)
+    assert table.column('id').to_pylist() == [1, 2]
+    assert table.column('angle').to_pylist() == [90.0, 90.0]
+
+
+def test_multiple_torque_modes(cnx):
+    motors = dicot.MotorList([cnx.motor(1), cnx.motor(2), cnx.motor(5)])
+    motors.torque_modes = ['on', 'off', 'brake']
+    b = b'\xfa\xaf\x00\x00\x24\x02\x03\x01\x01\x02\x00\x05\x02\x20'
+    cnx.ser.write.assert_called_once_with(b)
+
+
+def test_monitor_threshold(cnx):
+    motors = dicot.MotorList([cnx.motor(1), cnx.motor(2)])
+    monitor = dicot.Monitor([dicot.Threshold('temperature', upper=70)])
+    Status = dicot.motors.Status
+    cool = Status(0.0, 0, 0, 0, 40, 5.0)
+    hot = Status(0.0, 0, 0, 0, 75, 5.0)
+    assert monitor.feed(motors, [cool, cool]) == []
+    cnx.ser.write.assert_not_called()
+    trips = monitor.feed(motors, [cool, hot])
+    assert [t.id for t in trips] == [2]
+    assert trips[0].action == 'off'
+    assert trips[0].latency >= 0
+    cnx.ser.write.assert_called_once_with(
+        b'\xfa\xaf\x00\x00\x24\x02\x01\x02\x00\x25')
+    assert monitor.feed(motors, [cool, hot]) == []  # already tripped
+    monitor.reset(2)
+    assert len(monitor.feed(motors, [cool, hot])) == 1
+
+
+def test_monitor_rate_of_change(cnx):
+    motors = dicot.MotorList([cnx.motor(1)])
+    monitor = dicot.Monitor([dicot.RateOfChange('load', 100, 'brake')])
+    Status = dicot.motors.Status
+    assert monitor.feed(motors, [Status(0.0, 0, 0, 10, 40, 5.0)], 1.0) == []
+    assert monitor.feed(motors, [Status(0.0, 0, 0, 50, 40, 5.0)], 2.0) == []
+    trips = monitor.feed(motors, [Status(0.0, 0, 0, 300, 40, 5.0)], 2.5)
+    assert trips[0].action == 'brake'
+    cnx.ser.write.assert_called_once_with(
+        b'\xfa\xaf\x00\x00\x24\x02\x01\x01\x02\x24')
+
+
+def test_monitor_scheduler(cnx):
+    cnx.ser.baudrate = 115200
+    Status = dicot.motors.Status
+    monitor = dicot.Monitor([dicot.Threshold('temperature', upper=70)])
+    with dicot.Scheduler(cnx) as scheduler:
+        motors = dicot.MotorList([scheduler.connection('motion').motor(1)])
+        monitor.feed(motors, [Status(0.0, 0, 0, 10, 80, 5.0)])
+    stats = scheduler.stats()
+    assert stats['emergency'].dispatched == 1
+    assert stats['motion'].dispatched == 0
+
+
+def test_scheduler_order(cnx):
+    scheduler = dicot.Scheduler(cnx, start=False)
+    motor = cnx.motor(1)
+    scheduler.submit(motor_packet(motor, 'restart'), 'config')
+    scheduler.submit(motor_packet(motor, 'factory_reset'), 'telemetry')
+    scheduler.submit(motor_packet(motor, 'rom_write'), 'motion')
+    scheduler.submit(motor_packet(motor, 'restart'), 'motion', deadline=0.1)
+    scheduler.submit(motor_packet(motor, 'factory_reset'), 'emergency')
+    scheduler.start()
+    scheduler.close()
+    written = b''.join(
+        b''.join(args[0]) if name == 'writev' else bytes(args[0])
+        for name, args, _ in cnx.ser.method_calls
+        if name in ('write', 'writev'))
+    assert list(written[3::8]) == [0x10, 0x20, 0x40, 0x10, 0x20]
+    cnx.ser.writev.assert_called_once()  # the motion commands
+    stats = scheduler.stats()
+    assert stats['motion'].dispatched == 2
+    assert stats['motion'].max_queue_depth == 2
+    assert stats['config'].queue_depth == 0
+
+
+def test_scheduler_channel(cnx):
+    cnx.ser.read.return_value = DummyPacket(1).bytes
+    with dicot.Scheduler(cnx) as scheduler:
+        motor = scheduler.connection('motion').motor(1)
+        motor.max_torque = 80
+        _ = motor.max_torque
+    assert cnx.ser.write.call_args_list[0][0][0] == \
+        b'\xfa\xaf\x01\x00\x23\x01\x01\x50\x72'
+    assert scheduler.stats()['motion'].dispatched == 2
+
+
+def motor_packet(motor, name):
+    flags = {'rom_write': 0x40, 'restart': 0x20, 'factory_reset': 0x10}
+    return dicot.packets.SpecialCommandPacket(
+        motor.id, flag=flags[name], address=0xff, length=0x00)
+
+
+def test_scheduler_budget():
+    budget = dicot.scheduler.Budget(rate=1000, burst=0.01)
+    now = budget.updated
+    assert budget.capacity == 128
+    assert budget.consume(100, now) == 0
+    assert budget.consume(100, now) == pytest.approx(0.072)
+    assert budget.consume(100, now + 0.072) == 0
+    assert budget.tokens == pytest.approx(0, abs=1e-6)
+    assert budget.consume(200, now + 0.1) == pytest.approx(0.1)
+    assert budget.consume(200, now + 0.2) == 0  # larger than the bucket
+    assert budget.tokens == pytest.approx(-72)
+
+
+def test_scheduler_large_packet(cnx):
+    cnx.ser.baudrate = 115200
+    packet = DummyPacket(150)  # 30 motors with durations
+    with dicot.Scheduler(cnx) as scheduler:
+        futures = [scheduler.submit(packet, 'motion') for _ in range(2)]
+        for f in futures:
+            f.result(1)
+    assert scheduler.stats()['motion'].dispatched == 2
+
+
+def test_sample(cnx, mocker):
+    cnx.ser.baudrate = 115200
+    cnx.ser.read.side_effect = [
+        b'\xfd\xdf\x01\x00\x07\x01\x01\x12\x14',  # return delay 1000 us
+        b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00\x00\x00\x00\x06\x00\x2d'
+        b'\x00\xf4\x01\x00\x00\x00\x00\x00\x00\x00',
+        b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00\x00\x00\x00\x06\x00\x2d'
+        b'\x00\xf4\x01\x00\x00\x00\x00\x00\x00\x00'
+    ]
+    time_ = mocker.patch('dicot.connections.time')
+    time_.time.side_effect = [0.0, 0.0, 1.0, 1.01, 1.02, 1.03]
+    motor = cnx.motor(1)
+    sample = motor.sample
+    assert sample.status.angle == 90
+    assert (sample.sent, sample.received) == (1.0, 1.01)
+    assert sample.sampled == pytest.approx(1.01 - 260 / 115200 - 0.001)
+    sample = motor.sample  # return delay is cached
+    assert cnx.ser.read.call_count == 3
+
+
+def test_sample_skew():
+    Sample = dicot.motors.Sample
+    samples = dicot.motors.SampleList([
+        Sample(None, 0.0, 0.01, 0.005), Sample(None, 0.01, 0.02, 0.017)])
+    assert samples.skew == pytest.approx(0.012)
+    assert dicot.motors.SampleList().skew == 0.0
+
+
+def return_packet(id_, address, data):
+    b = bytearray([0xfd, 0xdf, id_, 0x00, address, len(data), 0x01])
+    b.extend(data)
+    b.append(dicot.packets.checksum(b))
+    return bytes(b)
+
+
+def test_cli_scan(mocker, capsys):
+    mocker.patch('serial.Serial')
+    serial_ = dicot.connections.serial.Serial.return_value
+    serial_.read.side_effect = [
+        b'', return_packet(2, 0x00, b'\x05\x40\x12'), b'\xfd\xdf\x03']
+    assert dicot.__main__.main(['-p', port, 'scan', '--ids', '1-3']) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[1].split() == ['2', '0x4005', '18']
+    assert out[2] == '1 motor(s) found'
+
+
+def test_cli_dump(mocker, capsys):
+    mocker.patch('serial.Serial')
+    serial_ = dicot.connections.serial.Serial.return_value
+    rom = bytearray(30)
+    rom[0:3] = b'\x05\x40\x12'
+    rom[4:8] = b'\x01\x00\x07\x00'
+    rom[8:12] = b'\xdc\x05\x24\xfa'
+    rom[14:16] = b'\x4b\x00'
+    rom[22:30] = b'\x01\x00\x02\x02\x01\x01\x64\x00'
+    serial_.read.return_value = return_packet(1, 0x00, rom)
+    assert dicot.__main__.main(['-p', port, 'dump', '--ids', '1']) == 0
+    settings = json.loads(capsys.readouterr().out)['1']
+    serial_.write.assert_called_once_with(b'\xfa\xaf\x01\x0f\x00\x1e\x00\x10')
+    assert settings['firm_version'] == 0x12
+    assert settings['baudrate'] == 115200
+    assert settings['cw_angle_limit'] == 150.0
+    assert settings['ccw_angle_limit'] == -150.0
+    assert settings['temperature_limit'] == 75
+    assert settings['torque_in_silence'] == 'on'
+    assert settings['cw_compliance_margin'] == 0.2
+    assert settings['punch'] == [0x00, 0x64]
+
+
+def test_cli_load(mocker, tmp_path):
+    mocker.patch('serial.Serial')
+    serial_ = dicot.connections.serial.Serial.return_value
+    path = tmp_path / 'rom.json'
+    path.write_text('{"1": {"id": 9, "cw_angle_limit": 100}}')
+    assert dicot.__main__.main(['-p', port, 'load', str(path)]) == 0
+    assert serial_.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x01\x00\x08\x02\x01\xe8\x03\xe1'),
+        mocker.call(b'\xfa\xaf\x01\x40\xff\x00\x00\xbe')]
+
+
+STATUS_DATA = b'\x84\x03\x00\x00\x00\x00\x06\x00\x2d\x00\xf4\x01' + bytes(6)
+
+
+def test_cli_status(mocker, capsys):
+    mocker.patch('serial.Serial')
+    serial_ = dicot.connections.serial.Serial.return_value
+    serial_.read.side_effect = [
+        return_packet(1, 0x07, b'\x12'),
+        return_packet(2, 0x07, b'\x12'),
+        return_packet(1, 0x2a, STATUS_DATA),
+        return_packet(2, 0x2a, STATUS_DATA)]
+    assert dicot.__main__.main(
+        ['-p', port, 'status', '--ids', '1,2', '--count', '1']) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split() == [
+        'id', 'angle', 'time', 'speed', 'load', 'temp', 'volt']
+    assert out[1].split() == ['1', '90.0', '0', '0', '6', '45', '5.00']
+    assert out[2].split()[0] == '2'
+    assert out[3].startswith('skew ')
+
+
+def test_cli_bench(mocker, capsys):
+    mocker.patch('serial.Serial')
+    serial_ = dicot.connections.serial.Serial.return_value
+    serial_.read.return_value = return_packet(1, 0x2a, STATUS_DATA)
+    assert dicot.__main__.main(
+        ['-p', port, 'bench', '--ids', '1,2', '--count', '3']) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].startswith('round trip (ms): min ')
+    assert out[1].startswith('sweep rate: ')
+    assert out[1].endswith('(2 motor(s))')
+    assert serial_.write.call_count == 3 + 3 * 2  # one sweep per iteration
+
+
+def test_cli_set_baud(mocker, capsys):
+    mocker.patch('serial.Serial')
+    mocker.patch('dicot.__main__.time')
+    serial_ = dicot.connections.serial.Serial.return_value
+    assert dicot.__main__.main(
+        ['-p', port, 'set-baud', '--ids', '1', '230400']) == 0
+    assert serial_.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x01\x00\x06\x01\x01\x09\x0e'),
+        mocker.call(b'\xfa\xaf\x01\x40\xff\x00\x00\xbe'),
+        mocker.call(b'\xfa\xaf\x01\x20\xff\x00\x00\xde')]
+    dicot.__main__.time.sleep.assert_called_once()
+    assert 'set to 230400' in capsys.readouterr().out
+
+
+def test_cli_bridge(mocker):
+    mocker.patch('serial.Serial')
+    server = mocker.patch('dicot.bridge.BridgeServer')
+    assert dicot.__main__.main(['-p', port, 'bridge']) == 0
+    assert server.call_args[0][1] == ('127.0.0.1', 7474)
+    server.return_value.__enter__.return_value.serve_forever.assert_called()
+    dicot.__main__.main(['-p', port, 'bridge', '--host', '0.0.0.0'])
+    assert server.call_args[0][1] == ('0.0.0.0', 7474)
+
+
+@pytest.fixture
+def bridge(cnx):
+    server = dicot.BridgeServer(cnx, ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_bridge_query(cnx, bridge, mocker):
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00' \
+        b'\x00\x00\x00\x06\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xb9'
+    with dicot.bridge.connect(*bridge.server_address) as remote:
+        assert remote.baudrate == 115200
+        motor = remote.motor(1)
+        assert motor.angle == 90
+        motor.max_torque = 80
+        motors = dicot.MotorList([motor, remote.motor(2), remote.motor(3)])
+        assert [s.angle for s in motors.statuses] == [90, 90, 90]
+    assert cnx.ser.write.call_args_list[1] == mocker.call(
+        b'\xfa\xaf\x01\x00\x23\x01\x01\x50\x72')
+    assert cnx.ser.write.call_count == 5
+
+
+def test_bridge_pipelining(cnx, bridge):
+    cnx.ser.read.return_value = DummyPacket(18).bytes
+    with dicot.bridge.connect(*bridge.server_address) as remote:
+        futures = [
+            remote.query_async(
+                [dicot.packets.MultiDataQueryPacket(i, flag=0x09)])
+            for i in range(1, 11)]
+        replies = [f.result(1) for f in futures]
+    assert [len(r[0].bytes) for r in replies] == [26] * 10
+    assert all(r[0].sent <= r[0].received for r in replies)
+
+
+def test_bridge_subscribe(cnx, bridge):
+    cnx.ser.read.return_value = DummyPacket(18).bytes
+    pushes = queue.Queue()
+    with dicot.bridge.connect(*bridge.server_address) as remote:
+        subscription = remote.subscribe([1, 2], 0.01, pushes.put)
+        replies = pushes.get(timeout=1)
+        remote.unsubscribe(subscription)
+    assert len(replies) == 2
+
+
+def test_bridge_query_timeout(cnx, bridge):
+    delay = 0.1
+
+    def read(size):
+        time.sleep(delay)  # as if the motor were absent
+        return b''
+
+    cnx.ser.read.side_effect = read
+    packets = [dicot.packets.MultiDataQueryPacket(i, flag=0x09)
+               for i in [1, 2, 3]]
+    with dicot.bridge.connect(*bridge.server_address, timeout=0.15) as remote:
+        assert len(remote.query_many(packets)) == 3
+        delay = 0.3
+        with pytest.raises(concurrent.futures.TimeoutError):
+            remote.query(packets[0])
+        assert remote._pending == {}
+
+
+def test_bridge_subscription_ids(cnx, bridge):
+    cnx.ser.read.return_value = DummyPacket(18).bytes
+    with dicot.bridge.connect(*bridge.server_address) as remote:
+        subscription = remote.subscribe([1], 0.01, lambda replies: None)
+        remote._ids = itertools.chain([subscription], remote._ids)
+        _ = remote.motor(1).max_torque  # does not reuse the id
+        assert subscription in remote._subscriptions
+    payload = struct.pack('>d', 0.01) + bytes([1])
+    with socket.create_connection(bridge.server_address) as sock:
+        rfile = sock.makefile('rb')
+        for _ in range(2):
+            dicot.bridge.send_frame(sock, dicot.bridge.SUBSCRIBE, 7, payload)
+        dicot.bridge.send_frame(sock, dicot.bridge.INFO, 8)
+        while dicot.bridge.recv_frame(rfile)[:2] != (dicot.bridge.REPLY, 8):
+            pass  # the frames are handled in order
+        running = [
+            t for t in threading.enumerate()
+            if isinstance(t, dicot.bridge.Subscription) and t.id == 7 and
+            not t.stopped.is_set()]
+        assert len(running) == 1
+        rfile.close()
+
+
+def test_bridge_callback_error(cnx, bridge):
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00' \
+        b'\x00\x00\x00\x06\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xb9'
+    pushed = threading.Event()
+
+    def callback(replies):
+        pushed.set()
+        raise RuntimeError()
+
+    with dicot.bridge.connect(*bridge.server_address) as remote:
+        subscription = remote.subscribe([1], 0.01, callback)
+        assert pushed.wait(1)
+        remote.unsubscribe(subscription)
+        assert remote.motor(1).angle == 90
+        assert remote._reader.is_alive()
+
+
+def test_plan_reads():
+    r = dicot.registers.REGISTERS
+    reads = dicot.registers.plan_reads(
+        [r['voltage'], r['angle'], r['cw_compliance_slope'], r['reversed']])
+    assert [(x.address, x.length) for x in reads] == [(0x05, 22), (0x2a, 12)]
+    reads = dicot.registers.plan_reads(
+        [r['reversed'], r['cw_compliance_slope']], max_gap=4)
+    assert [(x.address, x.length) for x in reads] == [(0x05, 1), (0x1a, 1)]
+
+
+def test_plan_writes():
+    r = dicot.registers.REGISTERS
+    writes = dicot.registers.plan_writes([
+        (r['ccw_compliance_slope'], b'\x02'),
+        (r['cw_compliance_margin'], b'\x03'),
+        (r['reversed'], b'\x01'),
+        (r['cw_compliance_slope'], b'\x04'),
+        (r['ccw_compliance_margin'], b'\x05'),
+        (r['cw_compliance_slope'], b'\x06')])
+    assert writes == [(0x05, b'\x01'), (0x18, b'\x03\x05\x06\x02')]
+
+
+def test_read_registers(cnx):
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x2a\x04\x01\x84\x03\x37' \
+        b'\x02\x00'
+    motor = cnx.motor(1)
+    values = motor.read_registers('time', 'angle')
+    cnx.ser.write.assert_called_once_with(b'\xfa\xaf\x01\x0f\x2a\x04\x00\x20')
+    assert values == {'time': 5670, 'angle': 90.0}
+
+
+def test_write_registers(cnx):
+    motor = cnx.motor(1)
+    with pytest.raises(ValueError):
+        motor.rom.write_registers(cw_compliance_margin=0.1, warmup_time=-1)
+    with pytest.raises(ValueError):
+        motor.write_registers(angle=10)
+    cnx.ser.write.assert_not_called()
+    motor.rom.write_registers(
+        cw_compliance_margin=0.1, ccw_compliance_margin=0.2)
+    cnx.ser.write.assert_called_once_with(
+        b'\xfa\xaf\x01\x00\x18\x02\x01\x01\x02\x19')
+
+
+def test_multiple_read_registers(cnx):
+    cnx.ser.read.return_value = b'\xfd\xdf\x01\x00\x32\x04\x01\x2d\x00\xf4' \
+        b'\x01\x00'
+    motors = dicot.MotorList([cnx.motor(1), cnx.motor(2)])
+    values = motors.read_registers('voltage', 'temperature')
+    assert values == [{'voltage': 5.0, 'temperature': 45}] * 2
+    assert cnx.ser.write.call_count == 2
+
+
+linux_only = pytest.mark.skipif(
+    not sys.platform.startswith('linux'), reason='requires Linux ttys')
+
+
+def fake_bus(fd, request_length, reply):
+    def run():
+        request = b''
+        while len(request) < request_length:
+            request += os.read(fd, request_length - len(request))
+        requests.append(request)
+        os.write(fd, reply)
+    requests = []
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, requests
+
+
+@linux_only
+def test_pty_transport():
+    from dicot import transports
+    reply = b'\xfd\xdf\x01\x00\x2a\x12\x01\x84\x03\x00\x00\x00\x00\x06\x00' \
+        b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xb9'
+    with dicot.open(None, timeout=0.1,
+                    transport=transports.PtyTransport) as cnx:
+        thread, requests = fake_bus(cnx.ser.peer_fd, 8, reply)
+        assert cnx.motor(1).angle == 90
+        thread.join()
+        assert requests == [b'\xfa\xaf\x01\x09\x00\x00\x01\x09']
+        reply = cnx.query(packets_.MultiDataQueryPacket(2, flag=0x09))
+        assert reply.bytes == b''  # no reply before the timeout
+        os.read(cnx.ser.peer_fd, 8)
+        motor = cnx.motor(1)
+        thread, requests = fake_bus(cnx.ser.peer_fd, 16, b'')
+        cnx.command_many([
+            packets_.SpecialCommandPacket(1, 0x20, 0xff, 0x00),
+            packets_.SpecialCommandPacket(1, 0x40, 0xff, 0x00)])
+        thread.join()
+        assert requests[0][3::8] == b'\x20\x40'
+        assert motor.id == 1
+
+
+@linux_only
+def test_pty_transport_writev():
+    from dicot import transports
+    buffers = [bytes([i]) * 10000 for i in range(4)]
+    with transports.PtyTransport(timeout=0.1) as ser:
+        thread, requests = fake_bus(ser.peer_fd, 40000, b'')
+        ser.writev(buffers)  # larger than the tty buffer
+        thread.join()
+        assert requests == [b''.join(buffers)]
+        with pytest.raises(TimeoutError):
+            ser.writev(buffers)  # nothing reads the peer
+
+
+@linux_only
+@pytest.mark.parametrize('baudrate', [115200, 153600])
+def test_posix_transport(baudrate):
+    from dicot import transports
+    master, slave = os.openpty()
+    try:
+        cnx = dicot.open(os.ttyname(slave), baudrate, timeout=0.5,
+                         transport=transports.PosixTransport)
+        with cnx:
+            assert not cnx.ser.low_latency_enabled  # not supported by ptys
+            thread, requests = fake_bus(master, 8, b'\xfd\xdf\x01\x00\x23'
+                                        b'\x01\x01\x50\x72')
+            assert cnx.motor(1).max_torque == 80
+            thread.join()
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def test_rom_transaction(cnx, mocker):
+    motor = cnx.motor(1)
+    with motor.rom.transaction(write=True) as rom:
+        rom.cw_compliance_margin = 0.1
+        rom.ccw_compliance_margin = 0.2
+        rom.cw_compliance_slope = 3
+        rom.ccw_compliance_slope = 4
+        rom.reversed = True
+        cnx.ser.write.assert_not_called()
+    assert cnx.ser.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x01\x00\x05\x01\x01\x01\x05'),
+        mocker.call(b'\xfa\xaf\x01\x00\x18\x04\x01\x01\x02\x03\x04\x18'),
+        mocker.call(b'\xfa\xaf\x01\x40\xff\x00\x00\xbe')]
+
+
+def test_nested_rom_transaction(cnx, mocker):
+    rom = cnx.motor(1).rom
+    with rom.transaction():
+        with rom.transaction(write=True):
+            rom.cw_compliance_slope = 3
+        cnx.ser.write.assert_not_called()
+    assert cnx.ser.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x01\x00\x1a\x01\x01\x03\x18'),
+        mocker.call(b'\xfa\xaf\x01\x40\xff\x00\x00\xbe')]
+
+
+def test_nested_transaction_error(cnx):
+    rom = cnx.motor(1).rom
+    with rom.transaction():
+        try:
+            with rom.transaction():
+                rom.ccw_compliance_slope = 4
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        rom.cw_compliance_slope = 3
+    cnx.ser.write.assert_called_once_with(
+        b'\xfa\xaf\x01\x00\x1a\x01\x01\x03\x18')
+
+
+def test_motor_transaction_with_rom(cnx, mocker):
+    motor = cnx.motor(1)
+    with motor.transaction():
+        motor.max_torque = 80
+        motor.rom.reversed = True
+        motor.id = 5
+        cnx.ser.write.assert_not_called()
+    assert cnx.ser.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x01\x00\x05\x01\x01\x01\x05'),
+        mocker.call(b'\xfa\xaf\x01\x00\x23\x01\x01\x50\x72'),
+        mocker.call(b'\xfa\xaf\x01\x00\x04\x01\x01\x05\x00')]
+    assert motor.id == 5
+
+
+def test_transaction_id_last(cnx, mocker):
+    rom = cnx.motor(1).rom
+    with rom.transaction():
+        rom.id = 5
+        rom.cw_compliance_margin = 0.1
+    assert cnx.ser.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x01\x00\x18\x01\x01\x01\x18'),
+        mocker.call(b'\xfa\xaf\x01\x00\x04\x01\x01\x05\x00')]
+    assert rom.id == 5
+
+
+def test_transaction_validation(cnx):
+    motor = cnx.motor(1)
+    with pytest.raises(ValueError):
+        with motor.transaction():
+            motor.max_torque = 50
+            motor.pid_coeff = 0
+    with pytest.raises(RuntimeError):
+        with motor.transaction():
+            motor.rotate(10)
+            raise RuntimeError()
+    cnx.ser.write.assert_not_called()
+    with motor.transaction():
+        motor.rotate(10)
+        motor.rotate(90, 5000)  # the last one wins
+    cnx.ser.write.assert_called_once_with(
+        b'\xfa\xaf\x01\x00\x1e\x04\x01\x84\x03\xf4\x01\x68')
+
+
+def test_multiple_rotate_deadband(cnx, mocker):
+    motors = dicot.MotorList(
+        [cnx.motor(1), cnx.motor(2), cnx.motor(5)],
+        deadband=0.5, refresh_every=3)
+    motors.angles = [10, 10, 50]
+    motors.angles = [10.5, 10.6, 50]
+    motors.angles = [10.5, 10.6, 50]
+    motors.angles = [10, 10, 50]  # full refresh
+    assert cnx.ser.write.call_args_list == [
+        mocker.call(b'\xfa\xaf\x00\x00\x1e\x03\x03\x01\x64\x00\x02\x64\x00'
+                    b'\x05\xf4\x01\xed'),
+        mocker.call(b'\xfa\xaf\x00\x00\x1e\x03\x01\x02\x6a\x00\x74'),
+        mocker.call(b'\xfa\xaf\x00\x00\x1e\x03\x03\x01\x64\x00\x02\x64\x00'
+                    b'\x05\xf4\x01\xed')]
+    assert motors.bytes_sent == 17 + 11 + 17
+    assert motors.bytes_saved == 6 + 17
+
+
+def test_multiple_rotate_deadband_with_duration(cnx):
+    motors = dicot.MotorList([cnx.motor(1), cnx.motor(2)], deadband=0)
+    motors.rotate([10, 20], [1000, 1000])
+    motors.rotate([10, 20.1], [1000, 500])
+    motors.refresh()
+    motors.rotate([10, 20.1], [1000, 500])
+    assert [len(c[0][0]) for c in cnx.ser.write.call_args_list] == [
+        18, 13, 18]